@@ -1,10 +1,11 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import ORJSONResponse
 import pandas as pd
 import numpy as np
 from typing import Dict, Any
 import asyncio
 import logging
+from itertools import count
 from utils.data_fetcher import BTCDataFetcher
 from utils.signal_evaluator import SignalEvaluator
 
@@ -12,11 +13,18 @@ from utils.signal_evaluator import SignalEvaluator
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="BTC Trading Signal Generator", version="1.0.0")
+app = FastAPI(
+    title="BTC Trading Signal Generator",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # Global variables
 btc_data = None
+# Next index to be served; only advanced under _idx_lock, requests work on their own claimed index
 current_index = 0
+_idx_gen = count(0)
+_idx_lock = asyncio.Lock()
 data_fetcher = None
 signal_evaluator = None
 
@@ -30,14 +38,49 @@ async def startup_event():
         data_fetcher = BTCDataFetcher()
         signal_evaluator = SignalEvaluator()
         logger.info("Fetching historical BTC data...")
-        btc_data = data_fetcher.fetch_historical_data(years=1)  # Reduced to 1 year
-        logger.info(f"Successfully loaded {len(btc_data) if btc_data is not None else 0} candles")
+        btc_data = await data_fetcher.fetch_historical_data(years=1)  # Reduced to 1 year
+        logger.info("Successfully loaded %d candles", len(btc_data) if btc_data is not None else 0)
     except Exception as e:
-        logger.error(f"Startup failed: {e}")
+        logger.error("Startup failed: %s", e)
         # Initialize with minimal setup
         data_fetcher = BTCDataFetcher()
         signal_evaluator = SignalEvaluator()
         btc_data = data_fetcher._generate_fallback_data(years=1)
+    data_fetcher.load_data(btc_data)
+    signal_evaluator.build_row_cache(
+        data_fetcher.ts_ns, data_fetcher.open, data_fetcher.high,
+        data_fetcher.low, data_fetcher.close, data_fetcher.volume
+    )
+    # Compile the profitability kernel now rather than on the first request
+    signal_evaluator.evaluate_trade_profitability("BUY", 1.0, 0.5, 2.0, data_fetcher.close[:24])
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close the pooled DeepSeek session and the signal cache"""
+    if signal_evaluator is not None:
+        await signal_evaluator.close()
+
+# Dependencies are async so FastAPI resolves them on the event loop instead of the threadpool
+async def get_fetcher() -> BTCDataFetcher:
+    if btc_data is None or data_fetcher is None:
+        raise HTTPException(status_code=503, detail="Service not initialized yet")
+    return data_fetcher
+
+async def get_evaluator() -> SignalEvaluator:
+    if signal_evaluator is None:
+        raise HTTPException(status_code=503, detail="Service not initialized yet")
+    return signal_evaluator
+
+async def claim_index():
+    """Atomically hand out the next start index, wrapping to 0 near the end of the data"""
+    global _idx_gen, current_index
+    async with _idx_lock:
+        index = next(_idx_gen)
+        if index + 74 >= len(btc_data):  # 50 + 24 hours for evaluation
+            _idx_gen = count(0)
+            index = next(_idx_gen)
+        current_index = index + 1
+    return index
 
 @app.get("/")
 async def root():
@@ -53,66 +96,59 @@ async def health_check():
     }
 
 @app.get("/signal/next")
-async def get_next_signal():
+async def get_next_signal(
+    fetcher: BTCDataFetcher = Depends(get_fetcher),
+    evaluator: SignalEvaluator = Depends(get_evaluator)
+):
     """Get signal for next candle and evaluate profitability"""
-    global current_index
-    
-    if btc_data is None or data_fetcher is None or signal_evaluator is None:
-        raise HTTPException(status_code=503, detail="Service not initialized yet")
-    
-    # Reset if we reach the end
-    if current_index + 74 >= len(btc_data):  # 50 + 24 hours for evaluation
-        current_index = 0
+    # Claim this request's index, resetting if we reach the end
+    index = await claim_index()
     
     # Get current chunk of 50 candles
-    chunk = data_fetcher.get_data_chunk(btc_data, current_index, 50)
+    chunk = fetcher.get_data_chunk(index, 50)
     if chunk is None:
         raise HTTPException(status_code=400, detail="Not enough data")
+    window_range, ohlc_block = evaluator.prepare_window(chunk, index)
     
-    # Format OHLC data
-    ohlc_formatted = signal_evaluator.format_ohlc_data(chunk)
-    
-    # Generate signal using DeepSeek
-    signal_data = await signal_evaluator.generate_signal(ohlc_formatted)
+    # Generate signal using DeepSeek (flat windows are answered HOLD without a call)
+    signal_data = await evaluator.generate_signal(ohlc_block, chunk, window_range)
     
-    # Get entry price (last close in the chunk)
-    entry_price = float(chunk.iloc[-1]['close'])
+    # Get entry price (last close in the chunk); stays a numpy scalar, orjson encodes it directly
+    entry_price = fetcher.close[index + 49]
     
-    # Get future prices for evaluation (next 24 hours)
-    future_start = current_index + 50
-    future_end = min(future_start + 24, len(btc_data))
-    future_prices = btc_data.iloc[future_start:future_end]['close'].tolist()
+    # Get future prices for evaluation (next 24 hours), as a view into the close column
+    future_prices = fetcher.get_future_closes(index + 50, 24)
     
     # Evaluate profitability
-    is_profitable, outcome, pnl_percent = signal_evaluator.evaluate_trade_profitability(
+    is_profitable, outcome, pnl_percent = evaluator.evaluate_trade_profitability(
         signal_data['signal'], entry_price, signal_data.get('stop_price'),
         signal_data.get('target_price'), future_prices
     )
     
     # Prepare response
     response = {
-        "current_index": current_index,
-        "entry_timestamp": str(chunk.index[-1]),
+        "current_index": index,
+        "entry_timestamp": np.datetime_as_string(fetcher.ts_ns[index + 49].view('datetime64[ns]'), unit='s'),
         "entry_price": entry_price,
         "signal_data": signal_data,
         "evaluation": {
             "profitable": is_profitable,
             "outcome": outcome,
-            "pnl_percent": round(pnl_percent, 2),
+            "pnl_percent": np.round(pnl_percent, 2),
             "evaluation_period_hours": min(24, len(future_prices))
         },
-        "next_index": current_index + 1
+        "next_index": index + 1
     }
     
-    current_index += 1
-    
-    return JSONResponse(content=response)
+    return ORJSONResponse(content=response)
 
 @app.get("/signal/reset")
 async def reset_index():
     """Reset the current index to start"""
-    global current_index
-    current_index = 0
+    global _idx_gen, current_index
+    async with _idx_lock:
+        _idx_gen = count(0)
+        current_index = 0
     return {"message": "Index reset to 0", "current_index": current_index}
 
 @app.get("/signal/current")
@@ -122,10 +158,11 @@ async def get_current_status():
         "current_index": current_index,
         "total_candles": len(btc_data) if btc_data is not None else 0,
         "remaining_candles": len(btc_data) - current_index if btc_data is not None else 0,
-        "data_quality": "real" if hasattr(data_fetcher, 'exchange') and data_fetcher.exchange else "synthetic"
+        "data_source": data_fetcher.data_source if data_fetcher is not None else None,
+        "data_quality": "synthetic" if data_fetcher is None or data_fetcher.data_source == 'synthetic' else "real"
     }
 
 # For local development
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop")
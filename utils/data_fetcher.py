@@ -1,111 +1,264 @@
-import ccxt
+import ccxt.async_support as ccxt_async
+import aiohttp
 import pandas as pd
+import pyarrow as pa
+import numpy as np
 from datetime import datetime, timedelta
 import time
 import asyncio
+import itertools
 import logging
+from collections import namedtuple
+from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+SYMBOL = 'BTC/USDT'
+TIMEFRAME = '1h'
+PAGE_LIMIT = 1000
+HOUR_MS = 3600_000
+MAX_CONCURRENT_PAGES = 8
+BINANCE_KLINES_URL = "https://api.binance.com/api/v3/klines"
+
+# Window of candles as array views (not copies) into the fetcher's columns
+Chunk = namedtuple('Chunk', 'open high low close volume ts')
+
 class BTCDataFetcher:
     def __init__(self):
         try:
-            self.exchange = ccxt.binance({
+            self.exchange = ccxt_async.binance({
                 'timeout': 30000,
                 'enableRateLimit': True,
-                'rateLimit': 1000,
             })
-            # Test connection
-            self.exchange.load_markets()
-            logger.info("Successfully connected to Binance API")
         except Exception as e:
-            logger.error(f"Failed to initialize exchange: {e}")
+            logger.error("Failed to initialize exchange: %s", e)
             # Fallback to a simpler approach
             self.exchange = None
+        self.cache_path = Path("cache/btc_1h.parquet")
+        # Where the loaded candles came from: 'exchange', 'cache' or 'synthetic'
+        self.data_source = None
+        self.table = None
+        self.ts_ns = None
+        self.open = self.high = self.low = self.close = self.volume = None
     
-    def fetch_historical_data(self, years=1):
+    async def fetch_historical_data(self, years=1):
         """Fetch historical BTC/USDT data with fallback"""
-        logger.info(f"Fetching {years} years of BTC data...")
+        logger.info("Fetching %s years of BTC data...", years)
+        now_ms = int(time.time() * 1000)
+        since = now_ms - 365 * years * 24 * HOUR_MS
+        cached = self._load_cache()
         
         try:
-            # Try to fetch from exchange
+            # Try to fetch from exchange, only requesting what the cache lacks
             if self.exchange:
-                since = int((datetime.now() - timedelta(days=365*years)).timestamp() * 1000)
-                all_ohlcv = []
-                
-                # Fetch data in chunks
-                while len(all_ohlcv) < 365 * years * 24:
-                    try:
-                        ohlcv = self.exchange.fetch_ohlcv('BTC/USDT', '1h', since=since, limit=1000)
-                        if not ohlcv:
-                            break
-                        
-                        since = ohlcv[-1][0] + 1
-                        all_ohlcv.extend(ohlcv)
-                        
-                        # Respect rate limits
-                        time.sleep(self.exchange.rateLimit / 1000)
-                        
-                    except Exception as e:
-                        logger.error(f"Error fetching chunk: {e}")
-                        break
+                ranges = self._missing_ranges(cached, since, now_ms)
+                all_ohlcv = await self._fetch_ranges(ranges)
                 
-                if all_ohlcv:
-                    df = pd.DataFrame(all_ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-                    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-                    df.set_index('timestamp', inplace=True)
-                    logger.info(f"Successfully fetched {len(df)} hourly candles from exchange")
-                    return df
+                if all_ohlcv or cached is not None:
+                    df = self._merge_candles(cached, all_ohlcv)
+                    logger.info("Fetched %d new hourly candles from exchange", len(all_ohlcv))
+                    if all_ohlcv:
+                        self._save_cache(df)
+                    self.data_source = 'exchange' if all_ohlcv else 'cache'
+                    return df[df.index >= pd.to_datetime(since, unit='ms')]
             
-            # Fallback: Generate synthetic data or use cached data
+            if cached is not None:
+                logger.warning("Exchange unavailable, using cached data")
+                self.data_source = 'cache'
+                return cached[cached.index >= pd.to_datetime(since, unit='ms')]
+            
+            # Fallback: Generate synthetic data
             logger.warning("Using fallback synthetic data")
             return self._generate_fallback_data(years)
             
         except Exception as e:
-            logger.error(f"Failed to fetch historical data: {e}")
+            logger.error("Failed to fetch historical data: %s", e)
+            if cached is not None:
+                self.data_source = 'cache'
+                return cached[cached.index >= pd.to_datetime(since, unit='ms')]
             return self._generate_fallback_data(years)
     
+    def _load_cache(self):
+        """Load cached candles from disk, or None if missing or unreadable"""
+        if not self.cache_path.exists():
+            return None
+        try:
+            df = pd.read_parquet(self.cache_path, engine='pyarrow')
+        except Exception as e:
+            logger.warning("Ignoring unreadable candle cache %s: %s", self.cache_path, e)
+            return None
+        if df.empty or not df.index.is_monotonic_increasing:
+            logger.warning("Ignoring invalid candle cache %s", self.cache_path)
+            return None
+        logger.info("Loaded %d cached candles up to %s", len(df), df.index.max())
+        return df
+    
+    def _save_cache(self, df):
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            df.to_parquet(self.cache_path, engine='pyarrow', compression='zstd')
+        except Exception as e:
+            logger.warning("Failed to write candle cache %s: %s", self.cache_path, e)
+    
+    def _missing_ranges(self, cached, since, until):
+        """Return the [start, end) millisecond ranges the cache does not cover.
+        
+        That is the incremental tail from the last cached candle on, any head
+        before the first one, and the inside of every gap longer than an hour.
+        """
+        if cached is None:
+            return [(since, until)]
+        
+        ts = cached.index.asi8 // 1_000_000
+        ranges = []
+        if ts[0] > since + HOUR_MS:
+            ranges.append((since, int(ts[0])))
+        gaps = np.flatnonzero(np.diff(ts) > HOUR_MS)
+        ranges.extend((int(ts[i]) + HOUR_MS, int(ts[i + 1])) for i in gaps if ts[i + 1] > since)
+        # The last cached candle may have been saved while still forming, so the tail
+        # starts at it and _merge_candles replaces it with the closed one
+        ranges.append((int(ts[-1]), until))
+        return ranges
+    
+    def _merge_candles(self, cached, ohlcv):
+        if not ohlcv:
+            return cached
+        rows = np.asarray(ohlcv, dtype=np.float64).reshape(-1, 6)
+        df = pd.DataFrame(
+            rows[:, 1:], columns=['open', 'high', 'low', 'close', 'volume'],
+            index=pd.to_datetime(rows[:, 0].astype(np.int64), unit='ms').rename('timestamp')
+        )
+        if cached is not None:
+            df = pd.concat([cached, df])
+        return df[~df.index.duplicated(keep='last')].sort_index()
+    
+    async def _fetch_ranges(self, ranges):
+        """Fetch all hourly candles in the given [since, until) ranges as concurrent page requests.
+        
+        The klines endpoint is stateless per window, so page boundaries are
+        computed up front and requested in parallel behind a semaphore that
+        keeps us well inside Binance's request weight budget.
+        """
+        windows = []
+        for since, until in ranges:
+            n_pages = max(1, -(-(until - since) // (PAGE_LIMIT * HOUR_MS)))
+            windows.extend(since + i * PAGE_LIMIT * HOUR_MS for i in range(n_pages))
+        sem = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+        
+        async def fetch_page(start, http):
+            async with sem:
+                try:
+                    return await self.exchange.fetch_ohlcv(SYMBOL, TIMEFRAME, since=start, limit=PAGE_LIMIT)
+                except Exception as e:
+                    logger.warning("ccxt page fetch failed at %s: %s, retrying via REST", start, e)
+                    return await self._fetch_klines_page(http, start)
+        
+        try:
+            async with aiohttp.ClientSession() as http:
+                pages = await asyncio.gather(*[fetch_page(s, http) for s in windows], return_exceptions=True)
+        finally:
+            await self.exchange.close()
+        
+        for start, page in zip(windows, pages):
+            if isinstance(page, Exception):
+                logger.error("Error fetching chunk at %s: %s", start, page)
+        
+        return list(itertools.chain.from_iterable(
+            page for page in pages if not isinstance(page, Exception)
+        ))
+    
+    async def _fetch_klines_page(self, http, start):
+        """Fetch one page straight from the Binance klines REST endpoint"""
+        params = {
+            'symbol': SYMBOL.replace('/', ''),
+            'interval': TIMEFRAME,
+            'startTime': start,
+            'limit': PAGE_LIMIT,
+        }
+        async with http.get(BINANCE_KLINES_URL, params=params, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            response.raise_for_status()
+            klines = await response.json()
+        return [[k[0], float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5])] for k in klines]
+    
     def _generate_fallback_data(self, years=1):
         """Generate fallback synthetic data"""
+        self.data_source = 'synthetic'
         start_date = datetime.now() - timedelta(days=365*years)
         dates = pd.date_range(start=start_date, end=datetime.now(), freq='H')
         
+        # One preallocated buffer; Fortran order keeps each column contiguous and lets
+        # pandas adopt it as a single block without copying
+        n = len(dates)
+        buf = np.empty((n, 5), dtype=np.float64, order='F')
+        opens, highs, lows, prices, volumes = buf.T
+        rng = np.random.default_rng(42)
+        
         # Create synthetic price data that resembles BTC
-        np.random.seed(42)
         base_price = 30000
-        returns = np.random.normal(0.0001, 0.01, len(dates))
-        prices = base_price * np.exp(np.cumsum(returns))
+        rng.standard_normal(n, out=prices)
+        prices *= 0.01
+        prices += 0.0001
+        np.cumsum(prices, out=prices)
+        np.exp(prices, out=prices)
+        prices *= base_price
+        np.multiply(prices, 0.999, out=opens)
         
         # Add some volatility
         volatility = 0.02
-        highs = prices * (1 + np.random.uniform(0, volatility, len(dates)))
-        lows = prices * (1 - np.random.uniform(0, volatility, len(dates)))
-        
-        df = pd.DataFrame({
-            'open': prices * 0.999,
-            'high': highs,
-            'low': lows,
-            'close': prices,
-            'volume': np.random.lognormal(10, 1, len(dates))
-        }, index=dates)
-        
-        logger.info(f"Generated {len(df)} synthetic hourly candles")
+        rng.random(n, out=highs)
+        highs *= volatility
+        highs += 1
+        highs *= prices
+        rng.random(n, out=lows)
+        lows *= -volatility
+        lows += 1
+        lows *= prices
+        
+        # Lognormal(10, 1) volumes
+        rng.standard_normal(n, out=volumes)
+        volumes += 10
+        np.exp(volumes, out=volumes)
+        
+        df = pd.DataFrame(buf, columns=['open', 'high', 'low', 'close', 'volume'], index=dates, copy=False)
+        
+        logger.info("Generated %d synthetic hourly candles", len(df))
         return df
 
-    def get_data_chunk(self, df, start_index, chunk_size=50):
+    def load_data(self, df):
+        """Keep the dataset as an Arrow table with per-column NumPy views for the request paths"""
+        # float32 is ample precision for hourly prices and halves the bytes every slice moves
+        df = df.astype(np.float32)
+        self.table = pa.Table.from_pandas(df.rename_axis('timestamp')).combine_chunks()
+        # Timestamps stay int64 nanoseconds; format them only when a response needs one
+        self.ts_ns = df.index.values.view('i8')
+        # Zero-copy, C-contiguous views over the Arrow buffers (SoA layout)
+        self.open, self.high, self.low, self.close, self.volume = (
+            self.table.column(name).chunk(0).to_numpy(zero_copy_only=True)
+            for name in Chunk._fields[:5]
+        )
+    
+    def get_data_chunk(self, start_index, chunk_size=50):
         """Get a chunk of OHLC data for analysis"""
-        if df is None or start_index + chunk_size > len(df):
+        if self.close is None or start_index + chunk_size > len(self.close):
             return None
         
-        chunk = df.iloc[start_index:start_index + chunk_size].copy()
-        return chunk
-
-async def fetch_current_price():
-    """Fetch current BTC price with fallback"""
-    try:
-        exchange = ccxt.binance()
-        ticker = exchange.fetch_ticker('BTC/USDT')
-        return ticker['last']
-    except Exception as e:
-        logger.error(f"Error fetching current price: {e}")
-        return 40000  # Fallback price
+        end = start_index + chunk_size
+        return Chunk(
+            self.open[start_index:end],
+            self.high[start_index:end],
+            self.low[start_index:end],
+            self.close[start_index:end],
+            self.volume[start_index:end],
+            self.ts_ns[start_index:end],
+        )
+    
+    def get_future_closes(self, start_index, hours=24):
+        """Closes of the `hours` following start_index, as a view into the close column
+        
+        The end is located by binary search on ts_ns, so a gap in the data
+        shortens the window instead of stretching it past `hours`.
+        """
+        if start_index >= len(self.close):
+            return self.close[:0]
+        end = np.searchsorted(self.ts_ns, self.ts_ns[start_index] + hours * HOUR_MS * 1_000_000)
+        return self.close[start_index:end]
@@ -1,110 +1,427 @@
 import json
+import asyncio
 import aiohttp
-from typing import Dict, Any
+import orjson
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional, Tuple
 import os
 import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from hashlib import blake2b
+from pathlib import Path
 from dotenv import load_dotenv
+from utils._njit import njit, NUMBA_AVAILABLE
 
-load_dotenv()
+# A key already in the environment (e.g. set by the platform) makes .env parsing unnecessary
+if not os.getenv('DEEPSEEK_API_KEY'):
+    load_dotenv()
+_API_KEY = os.getenv('DEEPSEEK_API_KEY', '')
 
 logger = logging.getLogger(__name__)
 
+# Outcome codes returned by _eval_trade; _HOLD only appears in evaluate_many results
+_EXIT_AT_END, _STOP_LOSS, _TAKE_PROFIT, _HOLD = 0, 1, 2, 3
+
+@njit(cache=True)
+def _eval_trade(side, stop, target, closes):
+    """Scan closes for the first stop/target hit; side is +1 for BUY, -1 for SELL"""
+    for i in range(closes.shape[0]):
+        price = closes[i]
+        if side > 0:
+            if price <= stop:
+                return _STOP_LOSS
+            if price >= target:
+                return _TAKE_PROFIT
+        else:
+            if price >= stop:
+                return _STOP_LOSS
+            if price <= target:
+                return _TAKE_PROFIT
+    
+    # If neither hit, the trade exits at the final price
+    return _EXIT_AT_END
+
+def _first_true(mask, axis=-1):
+    """Index of the first True along axis, or the axis length where there is none"""
+    return np.where(mask.any(axis=axis), mask.argmax(axis=axis), mask.shape[axis])
+
+def _eval_trade_vectorized(side, stop, target, closes):
+    """NumPy equivalent of _eval_trade: locate the first stop/target hit with argmax on boolean masks"""
+    if side > 0:
+        hit_stop = closes <= stop
+        hit_target = closes >= target
+    else:
+        hit_stop = closes >= stop
+        hit_target = closes <= target
+    
+    n = closes.shape[0]
+    stop_idx = _first_true(hit_stop)
+    target_idx = _first_true(hit_target)
+    
+    # The stop is checked first within a bar, so it wins ties
+    if stop_idx < n and stop_idx <= target_idx:
+        return _STOP_LOSS
+    if target_idx < n:
+        return _TAKE_PROFIT
+    return _EXIT_AT_END
+
+# Without numba the jitted loop would run as plain Python, so use the vectorized scan instead
+_scan_trade = _eval_trade if NUMBA_AVAILABLE else _eval_trade_vectorized
+
 class SignalEvaluator:
-    def __init__(self):
-        self.api_key = os.getenv('DEEPSEEK_API_KEY', '')
+    # Prompt text never interpolates per-request data, keeping the request prefix byte-identical
+    _SYSTEM_PROMPT = (
+        "You are an expert cryptocurrency trading analyst. Analyze OHLC data and provide clear "
+        "trading signals with proper risk management. Data is pipe-delimited OHLCV rows "
+        "(ts|open|high|low|close|volume), most recent last, with prices in USDT to 2 decimals and "
+        "volume in whole BTC; quote stop and target prices in USDT. Always respond with ONLY a "
+        "valid JSON object."
+    )
+    _USER_PREFIX = (
+        "Analyze the following BTC/USDT hourly OHLC data and generate a trading signal.\n"
+        "Respond with ONLY a JSON object containing: signal (BUY|SELL|HOLD), stop_price, target_price, "
+        "confidence (0-100), and reason (one short sentence).\n"
+        "Important: Consider technical analysis, price action, volume patterns, and market structure.\n"
+        "Provide realistic stop and target prices based on support/resistance levels.\n"
+        "Return ONLY JSON, no other text.\n\n"
+        "OHLC data (most recent last):\n"
+    )
+    _SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+    _JSON_DECODER = json.JSONDecoder()
+    # Outcome names indexed by the codes evaluate_many returns
+    OUTCOME_NAMES = ("EXIT_AT_END", "STOP_LOSS", "TAKE_PROFIT", "HOLD")
+    # Attempts per API call, with exponential backoff between retries of 429/5xx
+    _MAX_ATTEMPTS = 3
+    _RETRY_BASE_DELAY = 0.5
+    
+    def __init__(self, max_concurrency: int = 16):
+        self.api_key = _API_KEY
         self.base_url = "https://api.deepseek.com/v1/chat/completions"
-        logger.info(f"SignalEvaluator initialized with API key: {'Yes' if self.api_key else 'No'}")
-        
-    def format_ohlc_data(self, df_chunk):
-        """Format OHLC data for the prompt"""
-        formatted_data = []
-        for idx, row in df_chunk.iterrows():
-            formatted_data.append({
-                'timestamp': idx.strftime('%Y-%m-%d %H:%M:%S'),
-                'open': float(row['open']),
-                'high': float(row['high']),
-                'low': float(row['low']),
-                'close': float(row['close']),
-                'volume': float(row['volume'])
-            })
-        return formatted_data[-10:]  # Only send last 10 candles
-    
-    async def generate_signal(self, ohlc_data: list) -> Dict[str, Any]:
+        # Request pieces that never change, so each call only adds the user message
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        self._base_payload = {
+            "model": "deepseek-chat",
+            "temperature": 0,
+            "top_p": 1,
+            # JSON mode keeps the model from wrapping the object in prose; the five-field
+            # object fits well within 160 tokens, which bounds generation time without
+            # streaming (an early cut-off would close the pooled keep-alive connection)
+            "response_format": {"type": "json_object"},
+            "max_tokens": 160,
+            "stream": False
+        }
+        # Per-candle prompt rows, built once after data load, and formatted windows by start index
+        self._row_strs: List[str] = []
+        self._fmt_cache: Dict[int, str] = {}
+        # Answer HOLD without the LLM when the prompt window's high-low span (% of mean close)
+        # is below this; 0 disables
+        self.min_window_range_pct = float(os.getenv('SIGNAL_MIN_WINDOW_RANGE_PCT', '0.3'))
+        # LRU of API responses keyed by a hash of the OHLC block, optionally backed by SQLite.
+        # The hash is keyed by the prompt and request parameters, so changing either one
+        # stops earlier answers (in particular persisted ones) from being replayed
+        self._cache_version = blake2b(
+            orjson.dumps([self._SYSTEM_PROMPT, self._USER_PREFIX, self._base_payload]), digest_size=16
+        ).digest()
+        self.signal_cache_size = int(os.getenv('SIGNAL_CACHE_SIZE', '4096'))
+        self._sig_cache: OrderedDict = OrderedDict()
+        cache_path = os.getenv('SIGNAL_CACHE_PATH')
+        self._sig_db = self._open_signal_db(cache_path) if cache_path else None
+        # The connection is used from worker threads (see _db_get/_db_put), one at a time
+        self._sig_db_lock = threading.Lock()
+        # Concurrent DeepSeek requests to size the connection pool for, and the batch default
+        self.max_concurrency = max_concurrency
+        # Pooled HTTP client shared by all API calls, created on first use by _get_session
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        logger.info("SignalEvaluator initialized with API key: %s", 'Yes' if self.api_key else 'No')
+    
+    def build_row_cache(self, ts_ns, open_, high, low, close, volume):
+        """Preformat every candle of the dataset once so windows are just joins of existing strings"""
+        self._row_strs = self._format_rows(ts_ns, open_, high, low, close, volume)
+        self._fmt_cache.clear()
+        logger.info("Preformatted %d candles for prompting", len(self._row_strs))
+    
+    @staticmethod
+    def _format_rows(ts_ns, open_, high, low, close, volume):
+        """Format whole columns at once: one C-level tolist() per column, then a single zip"""
+        # One pipe-delimited row per candle, keys are stated once in the block header.
+        # Prices are quantized to cents and volume to whole BTC to keep numbers short in tokens.
+        # Timestamps are formatted in one vectorized strftime pass over the int64 column
+        timestamps = pd.DatetimeIndex(ts_ns.view('datetime64[ns]')).strftime('%Y-%m-%d %H:%M')
+        return [
+            f"{t}|{o:.2f}|{h:.2f}|{l:.2f}|{c:.2f}|{v:.0f}"
+            for t, o, h, l, c, v in zip(
+                timestamps, open_.tolist(), high.tolist(),
+                low.tolist(), close.tolist(), volume.tolist()
+            )
+        ]
+    
+    def format_ohlc_block(self, chunk, start_index=None):
+        """Prompt-ready OHLC block for the last 10 candles of the chunk
+        
+        When start_index (the chunk's position in the dataset) is given and the
+        row cache is built, the window is served from the preformatted rows and
+        memoized.
+        """
+        n = len(chunk.close)
+        # Only send last 10 candles
+        first = max(n - 10, 0)
+        if start_index is not None and self._row_strs:
+            block = self._fmt_cache.get(start_index)
+            if block is None:
+                block = self._join_rows(self._row_strs[start_index + first:start_index + n])
+                self._fmt_cache[start_index] = block
+            return block
+        
+        # Slice to the tail before formatting so the work is O(window), not O(chunk)
+        return self._join_rows(self._format_rows(
+            chunk.ts[first:], chunk.open[first:], chunk.high[first:],
+            chunk.low[first:], chunk.close[first:], chunk.volume[first:]
+        ))
+    
+    @staticmethod
+    def _join_rows(rows):
+        return f"ohlc[{len(rows)}]{{ts,o,h,l,c,v}}:\n" + "\n".join(rows)
+    
+    def prepare_window(self, chunk, start_index=None):
+        """Window range and prompt block for a chunk, for passing on to generate_signal
+        
+        Returns (window_range, ohlc_block). Both only read views of the chunk's
+        last 10 candles, so nothing is copied, and handing the range to
+        generate_signal saves it measuring the window again.
+        """
+        return self.window_range_pct(chunk), self.format_ohlc_block(chunk, start_index)
+    
+    @staticmethod
+    def window_range_pct(chunk, window=10):
+        """High-low span of the last `window` candles as a percentage of their mean close"""
+        close = chunk.close[-window:]
+        return float((chunk.high[-window:].max() - chunk.low[-window:].min()) / close.mean() * 100)
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared keep-alive session, creating it once"""
+        if self._session is None or self._session.closed:
+            async with self._session_lock:
+                if self._session is None or self._session.closed:
+                    # Pool sized with headroom over max_concurrency so batches never queue on
+                    # connections; connect/read timeouts keep a stalled socket from pinning one
+                    pool_size = self.max_concurrency * 2
+                    self._session = aiohttp.ClientSession(
+                        connector=aiohttp.TCPConnector(
+                            limit=pool_size,
+                            limit_per_host=pool_size,
+                            ttl_dns_cache=300,
+                            keepalive_timeout=75,
+                            enable_cleanup_closed=True
+                        ),
+                        timeout=aiohttp.ClientTimeout(total=60, connect=5, sock_read=55),
+                        read_bufsize=4 * 1024 * 1024
+                    )
+        return self._session
+    
+    async def close(self):
+        """Close the shared HTTP session and the signal cache database"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._sig_db is not None:
+            with self._sig_db_lock:
+                self._sig_db.close()
+                self._sig_db = None
+    
+    @staticmethod
+    def _open_signal_db(path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Queries run in worker threads; WAL with synchronous=NORMAL avoids an fsync per insert
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS signals (key BLOB PRIMARY KEY, signal TEXT NOT NULL)")
+        logger.info("Persisting signal cache to %s", path)
+        return db
+    
+    async def _cached_signal(self, key):
+        """Look a window up in the in-memory LRU, then in the on-disk cache across restarts"""
+        signal_data = self._sig_cache.get(key)
+        if signal_data is not None:
+            self._sig_cache.move_to_end(key)
+            return signal_data
+        if self._sig_db is not None:
+            # SQLite calls block, so they run off the event loop
+            row = await asyncio.to_thread(self._db_get, key)
+            if row is not None:
+                signal_data = orjson.loads(row[0])
+                if not self._is_valid_signal(signal_data):
+                    return None
+                self._remember_signal(key, signal_data)
+        return signal_data
+    
+    def _remember_signal(self, key, signal_data):
+        self._sig_cache[key] = signal_data
+        if len(self._sig_cache) > self.signal_cache_size:
+            self._sig_cache.popitem(last=False)
+    
+    def _db_get(self, key):
+        with self._sig_db_lock:
+            if self._sig_db is None:
+                return None
+            return self._sig_db.execute("SELECT signal FROM signals WHERE key = ?", (key,)).fetchone()
+    
+    def _db_put(self, key, signal_json):
+        with self._sig_db_lock:
+            if self._sig_db is None:
+                return
+            with self._sig_db:
+                self._sig_db.execute(
+                    "INSERT OR REPLACE INTO signals (key, signal) VALUES (?, ?)",
+                    (key, signal_json)
+                )
+    
+    async def generate_signal(self, ohlc_block: str, chunk,
+                              window_range: Optional[float] = None) -> Dict[str, Any]:
         """Generate trading signal using DeepSeek API or fallback"""
         
         # If no API key, use fallback
         if not self.api_key:
             logger.warning("No DeepSeek API key found, using fallback signal generator")
-            return self._generate_fallback_signal(ohlc_data)
+            return self._generate_fallback_signal(chunk)
+        
+        # A flat window almost always comes back HOLD, so don't pay a round-trip for it.
+        # Checked here rather than by callers so generate_signals_batch is gated too
+        if window_range is None:
+            window_range = self.window_range_pct(chunk)
+        if window_range < self.min_window_range_pct:
+            return {
+                "signal": "HOLD",
+                "stop_price": None,
+                "target_price": None,
+                "confidence": 50,
+                "reason": f"Window range {window_range:.2f}% below {self.min_window_range_pct}%, skipped analysis"
+            }
+        
+        # The prompt only varies by the OHLC block, so replayed windows are answered from cache
+        key = blake2b(ohlc_block.encode(), digest_size=16, key=self._cache_version).digest()
+        signal_data = await self._cached_signal(key)
+        if signal_data is not None:
+            return signal_data
         
-        prompt = f"""
-        Analyze the following BTC/USDT hourly OHLC data and generate a trading signal.
-        Respond with ONLY a JSON object containing: signal (BUY|SELL|HOLD), stop_price, target_price, 
-        confidence (0-100), and reason.
+        signal_data = await self._request_signal(ohlc_block)
+        if signal_data is None:
+            return self._generate_fallback_signal(chunk)
+        # Never cache a reply the rest of the pipeline can't use, or it would be replayed forever
+        if not self._is_valid_signal(signal_data):
+            logger.error("DeepSeek returned an invalid signal: %s", signal_data)
+            return self._generate_fallback_signal(chunk)
         
-        OHLC Data (most recent last):
-        {json.dumps(ohlc_data, indent=2)}
+        self._remember_signal(key, signal_data)
+        if self._sig_db is not None:
+            await asyncio.to_thread(self._db_put, key, orjson.dumps(signal_data).decode())
+        return signal_data
+    
+    @staticmethod
+    def _is_valid_signal(signal_data):
+        """A known signal label, with stop and target prices that are numbers or null"""
+        if not isinstance(signal_data, dict) or signal_data.get('signal') not in ("BUY", "SELL", "HOLD"):
+            return False
+        return all(
+            price is None or (isinstance(price, (int, float)) and not isinstance(price, bool))
+            for price in (signal_data.get('stop_price'), signal_data.get('target_price'))
+        )
+    
+    async def generate_signals_batch(self, windows: List[Tuple[str, Any]],
+                                     max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Generate signals for many (ohlc_block, chunk) windows concurrently, e.g. for a backtest
         
-        Important: Consider technical analysis, price action, volume patterns, and market structure.
-        Provide realistic stop and target prices based on support/resistance levels.
-        Return ONLY JSON, no other text.
+        Requests share the pooled session and signal cache; the semaphore caps
+        how many are in flight against DeepSeek at once. Results are in input order;
+        a window whose request raises gets the fallback signal instead of failing
+        the whole batch.
         """
+        sem = asyncio.Semaphore(max_concurrency or self.max_concurrency)
         
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        async def one(ohlc_block, chunk):
+            async with sem:
+                return await self.generate_signal(ohlc_block, chunk)
         
+        results = await asyncio.gather(
+            *(one(ohlc_block, chunk) for ohlc_block, chunk in windows), return_exceptions=True
+        )
+        signals = []
+        for (_, chunk), result in zip(windows, results):
+            if isinstance(result, Exception):
+                logger.error("Signal generation failed for a batch window: %s", result)
+                result = self._generate_fallback_signal(chunk)
+            signals.append(result)
+        return signals
+    
+    async def _request_signal(self, ohlc_block: str) -> Optional[Dict[str, Any]]:
+        """Request a single signal from the DeepSeek API, or None on any failure"""
+        # Variable data goes last so the stable prefix can hit DeepSeek's prompt cache
         payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are an expert cryptocurrency trading analyst. Analyze OHLC data and provide clear trading signals with proper risk management. Always respond with ONLY a valid JSON object."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.1,
-            "max_tokens": 500
+            **self._base_payload,
+            "messages": [self._SYSTEM_MESSAGE, {"role": "user", "content": self._USER_PREFIX + ohlc_block}]
         }
         
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        response_content = result['choices'][0]['message']['content']
-                        
-                        # Extract JSON from response
-                        try:
-                            # Clean the response to extract JSON
-                            json_str = response_content.strip()
-                            if '```json' in json_str:
-                                json_str = json_str.split('```json')[1].split('```')[0].strip()
-                            elif '```' in json_str:
-                                json_str = json_str.split('```')[1].split('```')[0].strip()
-                                
-                            signal_data = json.loads(json_str)
-                            return signal_data
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Failed to parse JSON response: {e}")
-                            logger.error(f"Response content: {response_content}")
-                            return self._generate_fallback_signal(ohlc_data)
-                    
-                    logger.error(f"API request failed with status {response.status}")
-                    return self._generate_fallback_signal(ohlc_data)
-                    
-        except Exception as e:
-            logger.error(f"Error calling DeepSeek API: {e}")
-            return self._generate_fallback_signal(ohlc_data)
-    
-    def _generate_fallback_signal(self, ohlc_data):
+        response_content = None
+        for attempt in range(1, self._MAX_ATTEMPTS + 1):
+            try:
+                # Reuse pooled connections instead of a TLS handshake per call; non-2xx raises
+                session = await self._get_session()
+                async with session.post(self.base_url, data=orjson.dumps(payload), headers=self._headers,
+                                        raise_for_status=True) as response:
+                    result = orjson.loads(await response.read())
+                choice = result['choices'][0]
+                response_content = choice['message']['content']
+                # A refusal or empty completion comes back with null content
+                if not isinstance(response_content, str):
+                    raise ValueError(f"no text content in response: {response_content!r}")
+                # Hitting max_tokens leaves the object unterminated; report that apart
+                # from malformed output, as it calls for a shorter reply, not a parser fix
+                if choice.get('finish_reason') == 'length':
+                    logger.error("DeepSeek reply truncated at max_tokens=%d", self._base_payload['max_tokens'])
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Response content: %s", response_content)
+                    return None
+                
+                # Extract JSON from response: decode the first object and ignore any
+                # surrounding prose or code fences
+                signal_data, _ = self._JSON_DECODER.raw_decode(
+                    response_content, response_content.index('{')
+                )
+                return signal_data
+            # JSON decode errors and str.index finding no '{' are ValueErrors; TypeError and
+            # AttributeError cover a response body of the wrong shape (e.g. null choices)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, IndexError,
+                    TypeError, AttributeError) as e:
+                status = getattr(e, 'status', None)
+                # Only rate limits and server errors are worth another try; auth and
+                # other 4xx errors will fail the same way again
+                if status is not None and (status == 429 or status >= 500) and attempt < self._MAX_ATTEMPTS:
+                    delay = self._RETRY_BASE_DELAY * 2 ** (attempt - 1)
+                    logger.warning("DeepSeek API returned %d, retrying in %.1fs", status, delay)
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error("Error calling DeepSeek API: %s", e)
+                if response_content is not None and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Response content: %s", response_content)
+                return None
+        return None
+    
+    def _generate_fallback_signal(self, chunk):
         """Generate a fallback signal without API"""
-        latest = ohlc_data[-1]
-        prev = ohlc_data[-2]
+        latest = {
+            'open': float(chunk.open[-1]),
+            'high': float(chunk.high[-1]),
+            'low': float(chunk.low[-1]),
+            'close': float(chunk.close[-1])
+        }
+        prev = {'close': float(chunk.close[-2])}
         
         # Simple trend detection
         if latest['close'] > latest['open'] and latest['close'] > prev['close']:
@@ -156,7 +473,8 @@ class SignalEvaluator:
         """
         Evaluate if the trade would have been profitable
         """
-        if signal == "HOLD" or not future_prices:
+        # Anything but BUY/SELL is a HOLD, the same mapping evaluate_many uses
+        if signal not in ("BUY", "SELL") or len(future_prices) == 0:
             return False, "HOLD", 0
         
         # Set default stop and target if not provided
@@ -166,27 +484,69 @@ class SignalEvaluator:
         if target_price is None:
             target_price = entry_price * 1.03 if signal == "BUY" else entry_price * 0.97
         
-        # Check if stop or target hit within next X hours
-        for i, future_price in enumerate(future_prices[:hours_to_evaluate]):
-            if signal == "BUY":
-                if future_price <= stop_price:
-                    return False, "STOP_LOSS", ((stop_price - entry_price) / entry_price) * 100
-                if future_price >= target_price:
-                    return True, "TAKE_PROFIT", ((target_price - entry_price) / entry_price) * 100
-            
-            elif signal == "SELL":
-                if future_price >= stop_price:
-                    return False, "STOP_LOSS", ((entry_price - stop_price) / entry_price) * 100
-                if future_price <= target_price:
-                    return True, "TAKE_PROFIT", ((entry_price - target_price) / entry_price) * 100
-        
-        # If neither hit, use final price
-        final_price = future_prices[min(hours_to_evaluate, len(future_prices)) - 1]
-        if signal == "BUY":
-            pnl = ((final_price - entry_price) / entry_price) * 100
-            outcome = "EXIT_AT_END"
-        else:  # SELL
-            pnl = ((entry_price - final_price) / entry_price) * 100
-            outcome = "EXIT_AT_END"
-        
-        return pnl > 0, outcome, pnl
+        side = 1 if signal == "BUY" else -1
+        # The scan is bandwidth-bound, so it runs in float32 (7 significant digits is ample
+        # for BTC prices); float32 views from the fetcher pass through without a copy
+        closes = np.asarray(future_prices[:hours_to_evaluate], dtype=np.float32)
+        code = _scan_trade(side, np.float32(stop_price), np.float32(target_price), closes)
+        
+        # P&L is computed in float64 from the exit price to keep the percentage exact
+        if code == _STOP_LOSS:
+            exit_price = stop_price
+        elif code == _TAKE_PROFIT:
+            exit_price = target_price
+        else:
+            exit_price = closes[-1]
+        entry = float(entry_price)
+        pnl = side * (float(exit_price) - entry) / entry * 100
+        
+        if code == _TAKE_PROFIT:
+            return True, "TAKE_PROFIT", pnl
+        if code == _STOP_LOSS:
+            return False, "STOP_LOSS", pnl
+        return bool(pnl > 0), "EXIT_AT_END", pnl
+    
+    def evaluate_many(self, signals, entries, stops, targets, price_matrix,
+                      hours_to_evaluate=24) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Evaluate many trades at once, row i of price_matrix holding trade i's future closes
+        
+        Labels other than BUY/SELL are HOLDs, and NaN stops/targets get the same
+        defaults as None, as in evaluate_trade_profitability. Returns (profitable, outcome codes as int8 indexing OUTCOME_NAMES, pnl_percent).
+        """
+        signals = np.asarray(signals)
+        side = np.where(signals == "BUY", 1, np.where(signals == "SELL", -1, 0))
+        entries = np.asarray(entries, dtype=np.float64)
+        stops = np.asarray(stops, dtype=np.float64)
+        targets = np.asarray(targets, dtype=np.float64)
+        stops = np.where(np.isnan(stops), entries * (1 - 0.02 * side), stops)
+        targets = np.where(np.isnan(targets), entries * (1 + 0.03 * side), targets)
+        
+        outcomes = np.full(side.shape[0], _HOLD, dtype=np.int8)
+        pnl = np.zeros(side.shape[0])
+        prices = np.asarray(price_matrix, dtype=np.float32)[:, :hours_to_evaluate]
+        # HOLD rows never reach the scan
+        active = side != 0
+        if not active.any() or prices.shape[1] == 0:
+            return np.zeros(side.shape[0], dtype=bool), outcomes, pnl
+        
+        prices = prices[active]
+        side, entries, stops, targets = side[active], entries[active], stops[active], targets[active]
+        # Same float32 comparisons as the single-trade scan, one pass over the whole matrix
+        buy = (side > 0)[:, None]
+        stop32 = stops.astype(np.float32)[:, None]
+        target32 = targets.astype(np.float32)[:, None]
+        n = prices.shape[1]
+        stop_idx = _first_true(np.where(buy, prices <= stop32, prices >= stop32), axis=1)
+        target_idx = _first_true(np.where(buy, prices >= target32, prices <= target32), axis=1)
+        
+        # The stop wins ties, as in _eval_trade
+        codes = np.where((stop_idx < n) & (stop_idx <= target_idx), _STOP_LOSS,
+                         np.where(target_idx < n, _TAKE_PROFIT, _EXIT_AT_END))
+        exit_price = np.where(codes == _STOP_LOSS, stops,
+                              np.where(codes == _TAKE_PROFIT, targets, prices[:, -1].astype(np.float64)))
+        outcomes[active] = codes
+        pnl[active] = side * (exit_price - entries) / entries * 100
+        
+        profitable = (outcomes == _TAKE_PROFIT) | ((outcomes == _EXIT_AT_END) & (pnl > 0))
+        return profitable, outcomes, pnl